@@ -1,9 +1,20 @@
 import aiohttp.web
+import asyncio
 import functools
 import json
 import msgpack
 import traceback
 
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+try:
+    import ormsgpack
+except ImportError:  # pragma: no cover
+    ormsgpack = None
+
 from camisole.utils import AcceptHeader
 import camisole.languages
 import camisole.ref
@@ -16,84 +27,150 @@ TYPE_MSGPACK = 'application/msgpack'
 CONTENT_TYPES = (TYPE_JSON, TYPE_MSGPACK)
 
 
+def _bytes_default(o):
+    """Best-effort decoding of bytes, for use as a JSON default hook."""
+    if isinstance(o, bytes):
+        try:
+            return o.decode(errors='replace')
+        except UnicodeDecodeError:
+            raise TypeError() from None
+    raise TypeError(f"Object of type {type(o).__name__} "
+                    "is not JSON serializable")
+
+
 class BinaryJsonEncoder(json.JSONEncoder):
     """Best-effort :class:`JSONEncoder` that tries to decode bytes."""
 
     def default(self, o):
         if isinstance(o, bytes):
-            try:
-                return o.decode(errors='replace')
-            except UnicodeDecodeError:
-                raise TypeError() from None
+            return _bytes_default(o)
         return super().default(o)
 
 
+if orjson is not None:
+    def _encode_json(payload):
+        return orjson.dumps(
+            payload,
+            option=orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS,
+            default=_bytes_default)
+
+    _decode_json = orjson.loads
+else:
+    def _encode_json(payload):
+        return json.dumps(
+            payload, cls=BinaryJsonEncoder, sort_keys=True).encode()
+
+    def _decode_json(data):
+        return json.loads(data.decode())
+
+if ormsgpack is not None:
+    _encode_msgpack = ormsgpack.packb
+    _decode_msgpack = ormsgpack.unpackb
+else:
+    _encode_msgpack = functools.partial(msgpack.dumps, use_bin_type=True)
+    _decode_msgpack = functools.partial(msgpack.loads, raw=False)
+
+_ENCODERS = {TYPE_JSON: _encode_json, TYPE_MSGPACK: _encode_msgpack}
+_DECODERS = {TYPE_JSON: _decode_json, TYPE_MSGPACK: _decode_msgpack}
+
+
+def _response(accepted_types, payload, code=200):
+    if len(accepted_types) == 1:
+        # fast path: most clients negotiate a single content type
+        content_type = accepted_types[0]
+        encoder = _ENCODERS.get(content_type)
+        if encoder is not None:
+            try:
+                return aiohttp.web.Response(status=code,
+                                            body=encoder(payload),
+                                            content_type=content_type)
+            except Exception:
+                pass
+    else:
+        for content_type in accepted_types:
+            encoder = _ENCODERS.get(content_type)
+            if encoder is None:
+                continue
+            try:
+                data = encoder(payload)
+            except Exception:
+                continue
+            return aiohttp.web.Response(status=code, body=data,
+                                        content_type=content_type)
+    # no acceptable content type
+    code = aiohttp.web.HTTPNotAcceptable.status_code
+    if TYPE_MSGPACK not in accepted_types:
+        # explain how to work around the issue
+        return _error(accepted_types, code,
+                      f"use 'Accept: {TYPE_MSGPACK}' to be able to "
+                      f"receive binary payloads")
+    # no encoder can work
+    return aiohttp.web.Response(status=code)
+
+
+def _error(accepted_types, code, msg):
+    return _response(accepted_types, {'success': False, 'error': msg}, code)
+
+
+def _format_exc(exc):
+    """Bounded-depth traceback rendering for error replies.
+
+    Cheaper than traceback.format_exc() under an error flood: the stack
+    walk is capped instead of rendering arbitrarily deep frames.
+    """
+    return ''.join(traceback.format_exception(
+        type(exc), exc, exc.__traceback__, limit=10))
+
+
+@functools.lru_cache(maxsize=256)
+def _accepted_types(header):
+    """Memoized Accept header parse; clients send few distinct headers."""
+    return tuple(AcceptHeader.get_best_accepted_types(header, CONTENT_TYPES))
+
+
 def json_msgpack_handler(wrapped):
     @functools.wraps(wrapped)
     async def wrapper(request):
-        accepted_types = list(AcceptHeader.get_best_accepted_types(
-            request.headers.getone('accept', '*/*'), CONTENT_TYPES))
+        accepted_types = _accepted_types(
+            request.headers.getone('accept', '*/*'))
         content_type = request.headers.getone('content-type', TYPE_JSON)
 
-        def encoder_for(content_type):
-            if content_type == TYPE_JSON:
-                return lambda e: json.dumps(
-                    e, cls=BinaryJsonEncoder, sort_keys=True).encode()
-            elif content_type == TYPE_MSGPACK:
-                return functools.partial(msgpack.dumps, use_bin_type=True)
-
-        def response(payload, code=200):
-            for content_type in accepted_types:
-                try:
-                    data = encoder_for(content_type)(payload)
-                except Exception:
-                    continue
-                return aiohttp.web.Response(status=code, body=data,
-                                            content_type=content_type)
-            # no acceptable content type
-            code = aiohttp.web.HTTPNotAcceptable.status_code
-            if TYPE_MSGPACK not in accepted_types:
-                # explain how to work around the issue
-                return error(code,
-                             f"use 'Accept: {TYPE_MSGPACK}' to be able to "
-                             f"receive binary payloads")
-            # no encoder can work
-            return aiohttp.web.Response(status=code)
-
-        def error(code, msg):
-            return response({'success': False, 'error': msg}, code)
-
-        if content_type == TYPE_MSGPACK:
-            decoder = functools.partial(msgpack.loads, raw=False)
-        else:
+        decoder = _DECODERS.get(content_type)
+        if decoder is None:
             content_type = TYPE_JSON
-            decoder = lambda e: json.loads(e.decode())
+            decoder = _DECODERS[TYPE_JSON]
 
         try:
             data = await request.read()
         except aiohttp.web.HTTPClientError as e:
-            return error(e.status_code, str(e))
-        except Exception:  # noqa
-            return error(
+            return _error(accepted_types, e.status_code, str(e))
+        except Exception as e:  # noqa
+            return _error(
+                accepted_types,
                 aiohttp.web.HTTPInternalServerError.status_code,
-                traceback.format_exc())
+                _format_exc(e))
 
         try:
             data = decoder(data) if data else {}
         except Exception:
-            return error(
+            return _error(
+                accepted_types,
                 aiohttp.web.HTTPBadRequest.status_code,
                 f"malformed {content_type}")
 
         try:
             # actually execute handler
             result = await wrapped(request, data)
-        except Exception:  # noqa
-            return error(
+        except Exception as e:  # noqa
+            return _error(
+                accepted_types,
                 aiohttp.web.HTTPInternalServerError.status_code,
-                traceback.format_exc())
+                _format_exc(e))
 
-        return response({'success': True, **result})
+        # tag success in place: rebuilding the dict would shallow-copy
+        # every key of a potentially large test-result payload
+        result.setdefault('success', True)
+        return _response(accepted_types, result)
 
     return wrapper
 
@@ -138,12 +215,23 @@ async def interactive_handler(request, data):
 
 @json_msgpack_handler
 async def test_handler(request, data):
+    from camisole.conf import conf
+
     langs = camisole.languages.all().keys()
     langs -= set(data.get('exclude', []))
 
+    # reference tests are independent sandboxed runs; run them
+    # concurrently, bounded to avoid exhausting isolate boxes
+    names = list(langs)
+    semaphore = asyncio.Semaphore(conf['max-parallel-tests'])
+
+    async def test_one(name):
+        async with semaphore:
+            return await camisole.ref.test(name)
+
+    outcomes = await asyncio.gather(*(test_one(name) for name in names))
     results = {name: {'success': success, 'raw': raw}
-               for name in langs
-               for success, raw in [await camisole.ref.test(name)]}
+               for name, (success, raw) in zip(names, outcomes)}
     return {'results': results}
 
 
@@ -152,15 +240,28 @@ async def system_handler(request, data):
     return {'system': camisole.system.info()}
 
 
+# The registry is frozen once languages are loaded at startup, so the
+# /languages payload can be computed on first request and reused.
+_languages_payload = None
+
+
 @json_msgpack_handler
 async def languages_handler(request, data):
-    return {'languages': {lang: {'name': cls.name, 'programs': cls.programs()}
-                          for lang, cls in camisole.languages.all().items()}}
+    global _languages_payload
+    if _languages_payload is None:
+        _languages_payload = {
+            lang: {'name': cls.name, 'programs': cls.programs()}
+            for lang, cls in camisole.languages.all().items()}
+    return {'languages': _languages_payload}
+
+
+_DEFAULT_BODY = (
+    b"Welcome to Camisole. Use the /run endpoint to run some code!. "
+    b"Use the /interactive endpoint to run an interactive problem.\n")
 
 
 async def default_handler(request):
-    return aiohttp.web.Response(
-        text="Welcome to Camisole. Use the /run endpoint to run some code!. Use the /interactive endpoint to run an interactive problem.\n")
+    return aiohttp.web.Response(body=_DEFAULT_BODY, content_type='text/plain')
 
 
 def make_application(**kwargs):
@@ -17,10 +17,14 @@
 # You should have received a copy of the GNU General Public License
 # along with Prologin-SADM.  If not, see <http://www.gnu.org/licenses/>.
 
+import asyncio
+import collections
 import functools
+import hashlib
 import logging
 import os
 import re
+import shutil
 import subprocess
 import tempfile
 import warnings
@@ -31,6 +35,48 @@ import camisole.isolate
 import camisole.utils
 from camisole.conf import conf
 
+_BOX_RE = re.compile(r'/var/(?:local/)?lib/isolate/[0-9]+')
+
+# content-addressed cache of successful compilations, keyed on source and
+# compiler identity; bounded LRU, size set by conf['compile-cache-size']
+_compile_cache = collections.OrderedDict()
+
+
+@functools.lru_cache(maxsize=None)
+def _compile_re(pattern):
+    # most Programs share the default version regex; compile it once
+    return re.compile(pattern)
+
+
+def _compile_cache_key(lang, source):
+    h = hashlib.blake2b(digest_size=16)
+    for part in (type(lang).__qualname__,
+                 lang.compiler.cmd,
+                 repr(lang.compiler.opts),
+                 repr(lang.opts.get('compile', {}))):
+        h.update(part.encode())
+        h.update(b'\0')
+    h.update(source)
+    return h.digest()
+
+# meta block reported for tests skipped after a short-circuit; shared
+# read-only by every skipped slot
+_SHORT_META_DEFAULTS = {
+    'cg-mem': 0,
+    'cg-oom-killed': 0,
+    'csw-forced': 0,
+    'csw-voluntary': 0,
+    'exitcode': 0,
+    'exitsig': 0,
+    'exitsig-message': None,
+    'killed': False,
+    'max-rss': 0,
+    'message': None,
+    'status': 'SHORT_CIRCUIT',
+    'time': 0.0,
+    'time-wall': 0.0,
+}
+
 
 class Program:
     def __init__(self, cmd, *, opts=None, env=None,
@@ -42,7 +88,7 @@ class Program:
         self.env = env or {}
         self.version_opt = version_opt
         self.version_lines = version_lines
-        self.version_regex = re.compile(version_regex)
+        self.version_regex = _compile_re(version_regex)
 
     @functools.lru_cache()
     def _version(self):
@@ -52,12 +98,14 @@ class Program:
                               stderr=subprocess.STDOUT, stdout=subprocess.PIPE)
         return proc.stdout.decode().strip()
 
+    @functools.lru_cache()
     def version(self):
         if self.version_opt is None:  # noqa
             return None
         res = self.version_regex.search(self._version())
         return res.group(0) if res else None
 
+    @functools.lru_cache()
     def long_version(self):
         if self.version_opt is None:
             return None
@@ -116,6 +164,9 @@ class Lang(metaclass=MetaLang):
 
     def __init__(self, opts):
         self.opts = opts
+        # on-disk snapshot of the compile output, used by write_binary()
+        # to copy within the kernel instead of through Python bytes
+        self._binary_file = None
 
     @classmethod
     def required_binaries(cls):
@@ -147,12 +198,20 @@ class Lang(metaclass=MetaLang):
             env = {'HOME': self.filter_box_prefix(str(wd))}
             source = wd / self.source_filename()
             compiled = wd / self.execute_filename()
-            with source.open('wb') as sourcefile:
-                sourcefile.write(
-                    camisole.utils.force_bytes(self.opts.get('source', '')))
+            source.write_bytes(
+                camisole.utils.force_bytes(self.opts.get('source', '')))
             cmd = self.compile_command(str(source), str(compiled))
             await isolator.run(cmd, env={**env, **self.compiler.env})
             binary = self.read_compiled(str(compiled), isolator)
+            if isinstance(binary, bytes):
+                # snapshot the output before the box is cleaned up
+                snapshot = tempfile.NamedTemporaryFile(
+                    prefix='camisole-bin-')
+                try:
+                    shutil.copyfile(compiled, snapshot.name)
+                    self._binary_file = snapshot
+                except OSError:
+                    snapshot.close()
 
         root_tmp.cleanup()
 
@@ -179,6 +238,19 @@ class Lang(metaclass=MetaLang):
 
     async def run_compilation(self, result):
         if self.compiler is not None:
+            cache_size = conf['compile-cache-size']
+            key = None
+            if cache_size:
+                source = camisole.utils.force_bytes(
+                    self.opts.get('source', ''))
+                key = _compile_cache_key(self, source)
+                cached = _compile_cache.get(key)
+                if cached is not None:
+                    _compile_cache.move_to_end(key)
+                    info, binary = cached
+                    # hand out a copy so callers cannot mutate the cache
+                    result['compile'] = dict(info)
+                    return binary
             cretcode, info, binary = await self.compile()
             result['compile'] = info
             if cretcode != 0:
@@ -188,6 +260,10 @@ class Lang(metaclass=MetaLang):
                     result['compile']['stderr'] += b'\n\n'
                 result['compile']['stderr'] += b'Cannot find result binary.\n'
                 return
+            if key is not None and isinstance(binary, bytes):
+                _compile_cache[key] = (dict(info), binary)
+                while len(_compile_cache) > cache_size:
+                    _compile_cache.popitem(last=False)
         else:
             binary = camisole.utils.force_bytes(self.opts.get('source', ''))
         return binary
@@ -195,29 +271,16 @@ class Lang(metaclass=MetaLang):
     async def run_tests(self, binary, result):
         tests = self.opts.get('tests', [{}])
         if tests:
-            result['tests'] = [{}] * len(tests)
+            # fresh dicts: [{}] * n would alias a single shared object, and
+            # slots skipped by a fatal-test break stay {} on the wire
+            result['tests'] = [{} for _ in tests]
         is_shorted = False
         for i, test in enumerate(tests):
             test_name = test.get('name', 'test{:03d}'.format(i))
             if is_shorted:
-                short_meta_defaults = {
-                    'cg-mem': 0,
-                    'cg-oom-killed': 0,
-                    'csw-forced': 0,
-                    'csw-voluntary': 0,
-                    'exitcode': 0,
-                    'exitsig': 0,
-                    'exitsig-message': None,
-                    'killed': False,
-                    'max-rss': 0,
-                    'message': None,
-                    'status': 'SHORT_CIRCUIT',
-                    'time': 0.0,
-                    'time-wall': 0.0,
-                }
                 result['tests'][i] = {
                     'name': test_name,
-                    'meta': short_meta_defaults
+                    'meta': _SHORT_META_DEFAULTS
                 }
                 continue
             retcode, info = await self.execute(binary, test)
@@ -260,8 +323,11 @@ class Lang(metaclass=MetaLang):
 
     def write_binary(self, path, binary):
         compiled = path / self.execute_filename()
-        with compiled.open('wb') as c:
-            c.write(binary)
+        if self._binary_file is not None:
+            # copy the compile-time snapshot within the kernel
+            shutil.copyfile(self._binary_file.name, compiled)
+        else:
+            compiled.write_bytes(binary)
         compiled.chmod(0o700)
         return compiled
 
@@ -276,7 +342,10 @@ class Lang(metaclass=MetaLang):
 
     @staticmethod
     def filter_box_prefix(s):
-        return re.sub('/var/(local/)?lib/isolate/[0-9]+', '', s)
+        # most paths do not contain a box prefix; skip the regex for them
+        if '/var/' not in s:
+            return s
+        return _BOX_RE.sub('', s)
 
     def compile_command(self, source, output):
         if self.compiler is None:
@@ -337,8 +406,10 @@ class InteractiveLang:
     async def run(self):
         result_prog = {}
         result_interact = {}
-        binary_prog = await self.lang_prog.run_compilation(result_prog)
-        binary_interact = await self.lang_interact.run_compilation(result_interact)
+        # both compilations run in their own sandbox: overlap them
+        binary_prog, binary_interact = await asyncio.gather(
+            self.lang_prog.run_compilation(result_prog),
+            self.lang_interact.run_compilation(result_interact))
         if not binary_prog or not binary_interact:
             return {'prog': result_prog, 'interact': result_interact}
         await self.run_tests(binary_prog, binary_interact, result_prog, result_interact)
@@ -366,8 +437,7 @@ class InteractiveLang:
             compiled_prog = self.lang_prog.write_binary(Path(wd_prog), binary_prog)
             compiled_interact = self.lang_interact.write_binary(Path(wd_interact), binary_interact)
             input_file = Path(wd_interact) / 'input.txt'
-            with input_file.open('wb') as f:
-                f.write(input_data)
+            input_file.write_bytes(input_data)
             env_prog = {**env_prog, **(self.lang_prog.interpreter.env if self.lang_prog.interpreter else {})}
             env_interact = {**env_interact, **(self.lang_interact.interpreter.env if self.lang_interact.interpreter else {})}
             await camisole.isolate.Isolator.run_interactive(isolator_prog, isolator_interact, self.lang_prog.execute_command(str(compiled_prog)), self.lang_interact.execute_command(str(compiled_interact)) + ['input.txt'], env_prog, env_interact)
@@ -377,34 +447,19 @@ class InteractiveLang:
     async def run_tests(self, binary_prog, binary_interact, result_prog, result_interact):
         tests = self.lang_interact.opts.get('tests', [{}])
         if tests:
-            result_prog['tests'] = [{}] * len(tests)
-            result_interact['tests'] = [{}] * len(tests)
+            result_prog['tests'] = [{} for _ in tests]
+            result_interact['tests'] = [{} for _ in tests]
         is_shorted = False
         for i, test in enumerate(tests):
             test_name = test.get('name', 'test{:03d}'.format(i))
             if is_shorted:
-                short_meta_defaults = {
-                    'cg-mem': 0,
-                    'cg-oom-killed': 0,
-                    'csw-forced': 0,
-                    'csw-voluntary': 0,
-                    'exitcode': 0,
-                    'exitsig': 0,
-                    'exitsig-message': None,
-                    'killed': False,
-                    'max-rss': 0,
-                    'message': None,
-                    'status': 'SHORT_CIRCUIT',
-                    'time': 0.0,
-                    'time-wall': 0.0,
-                }
                 result_prog['tests'][i] = {
                     'name': test_name,
-                    'meta': short_meta_defaults
+                    'meta': _SHORT_META_DEFAULTS
                 }
                 result_interact['tests'][i] = {
                     'name': test_name,
-                    'meta': short_meta_defaults
+                    'meta': _SHORT_META_DEFAULTS
                 }
                 continue
             
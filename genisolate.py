@@ -28,8 +28,7 @@ num_boxes = 5050
 #box0.cpus = 4-7
 #box0.mems = 1"""
 
-for i in range(5030):
-    base += f"\nbox{i}.cpus = {i%8}"
-
 with open("isolate", "w") as f:
-    f.write(base + "\n")
\ No newline at end of file
+    f.write(base)
+    f.write("\n")
+    f.writelines(f"box{i}.cpus = {i%8}\n" for i in range(5030))
\ No newline at end of file
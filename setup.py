@@ -18,6 +18,10 @@ setup(
         'msgpack',
         'pyyaml',
     ],
+    extras_require={
+        # Rust-backed encoders picked up by camisole.httpserver when present
+        'speed': ['orjson', 'ormsgpack'],
+    },
     setup_requires=['pytest-runner', 'setuptools_scm'],
     tests_require=['pytest', 'pytest-cov', 'pytest-asyncio'],
     test_suite='pytest',
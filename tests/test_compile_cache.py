@@ -0,0 +1,87 @@
+import pytest
+
+import camisole.models
+import camisole.utils
+from camisole.conf import conf
+from camisole.models import Lang, Program
+
+
+def stub_lang():
+    """An unregistered Lang whose compile() never touches isolate."""
+    class StubLang(Lang, register=False):
+        source_ext = '.stub'
+        compiler = Program('true', version_opt=None)
+        calls = 0
+
+        async def compile(self):
+            type(self).calls += 1
+            source = camisole.utils.force_bytes(self.opts.get('source', ''))
+            info = {'stdout': b'', 'stderr': b'', 'exitcode': 0,
+                    'meta': {'status': 'OK'}}
+            return 0, info, b'binary:' + source
+
+    return StubLang
+
+
+@pytest.fixture(autouse=True)
+def clean_cache():
+    camisole.models._compile_cache.clear()
+    yield
+    camisole.models._compile_cache.clear()
+    conf.reset()
+
+
+@pytest.mark.asyncio
+async def test_identical_submission_skips_compile():
+    lang = stub_lang()
+    first = {}
+    binary = await lang({'source': 'a'}).run_compilation(first)
+    assert lang.calls == 1
+
+    second = {}
+    assert await lang({'source': 'a'}).run_compilation(second) == binary
+    assert lang.calls == 1
+    assert second['compile'] == first['compile']
+
+    # cached replies are copies: mutating one must not taint the next
+    second['compile']['stderr'] += b'oops'
+    third = {}
+    await lang({'source': 'a'}).run_compilation(third)
+    assert third['compile'] == first['compile']
+
+
+@pytest.mark.asyncio
+async def test_different_source_or_compile_opts_miss():
+    lang = stub_lang()
+    await lang({'source': 'a'}).run_compilation({})
+    await lang({'source': 'b'}).run_compilation({})
+    assert lang.calls == 2
+
+    await lang({'source': 'a', 'compile': {'time': 1}}).run_compilation({})
+    assert lang.calls == 3
+
+
+@pytest.mark.asyncio
+async def test_cache_disabled():
+    conf.merge({'compile-cache-size': 0})
+    lang = stub_lang()
+    await lang({'source': 'a'}).run_compilation({})
+    await lang({'source': 'a'}).run_compilation({})
+    assert lang.calls == 2
+    assert not camisole.models._compile_cache
+
+
+@pytest.mark.asyncio
+async def test_lru_bound_evicts_oldest():
+    conf.merge({'compile-cache-size': 2})
+    lang = stub_lang()
+    for source in 'abc':
+        await lang({'source': source}).run_compilation({})
+    assert lang.calls == 3
+    assert len(camisole.models._compile_cache) == 2
+
+    # 'a' was evicted, 'c' is still cached
+    await lang({'source': 'a'}).run_compilation({})
+    assert lang.calls == 4
+    await lang({'source': 'c'}).run_compilation({})
+    assert lang.calls == 4